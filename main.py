@@ -1,12 +1,23 @@
 import argparse
 import datetime
+import itertools
+import os
+import queue
+import threading
 import time
+import traceback
 
 import cv2
-import imutils
 import numpy as np
 from imutils.video import FPS, VideoStream
 
+# ONNX Runtime is optional; when present (together with an ONNX export of
+# the model) it replaces the OpenCV dnn engine
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 import config_file_loader
 
 from activities.detect_activity import detect_activity
@@ -25,8 +36,29 @@ ARGUMENT_PARSER.add_argument("-f", "--file", type=str, default="config.json",
                              help="Name of the configuration file. Defaults to 'config.json' \
                 in the directory where the main script is located")
 
+ARGUMENT_PARSER.add_argument("-t", "--dnn-target", type=str, default="cpu",
+                             choices=["cpu", "opencl"],
+                             help="device the network runs on. 'opencl' offloads \
+                inference to the integrated GPU, freeing the CPU for capture, \
+                tracking and drawing. Defaults to 'cpu'")
+
+ARGUMENT_PARSER.add_argument("-s", "--skip-frames", type=int, default=1,
+                             help="run inference only every Nth frame, reusing the last \
+                detections in between. Defaults to 1 (inference on every frame)")
+
+ARGUMENT_PARSER.add_argument("-b", "--batch-size", type=int, default=1,
+                             help="number of frames batched into a single forward pass. \
+                Larger batches amortize per-layer setup cost at the price of \
+                batch-1 frames of extra latency. Defaults to 1")
+
 ARGUMENTS = vars(ARGUMENT_PARSER.parse_args())
 
+if ARGUMENTS["skip_frames"] < 1:
+    ARGUMENT_PARSER.error("--skip-frames must be at least 1")
+
+if ARGUMENTS["batch_size"] < 1:
+    ARGUMENT_PARSER.error("--batch-size must be at least 1")
+
 # initialize the list of class labels MobileNet SSD was trained to
 # detect, then generate a set of bounding box colors for each class
 CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
@@ -59,8 +91,303 @@ COLORS = [
     (112, 113, 56),  # tvmonitor
 ]
 
+# cv2 drawing functions want plain int tuples; normalize the table once at
+# import so COLORS[idx] needs no per-detection conversion (the person entry
+# above still carries floats from the old np.random.uniform table)
+COLORS = [tuple(int(channel) for channel in color) for color in COLORS]
+
 CURRENT_DATE_FORMAT_STRING = "%A %d %B %Y %I:%M:%S %p"
 
+# Width every captured frame is resized to before processing
+FRAME_WIDTH = 600
+
+# MobileNet-SSD preprocessing parameters: input size, scale factor and mean
+# used both by the live loop and by the calibration in quantize_model.py
+BLOB_SIZE = (300, 300)
+BLOB_SCALE = 0.007843
+BLOB_MEAN = 127.5
+
+PROTOTXT_FILE = './MobileNetSSD_deploy.prototxt.txt'
+CAFFEMODEL_FILE = './MobileNetSSD_deploy.caffemodel'
+# ONNX export of the Caffe model (see quantize_model.py for the conversion
+# command)
+ONNX_MODEL_FILE = './MobileNetSSD_deploy.onnx'
+# Produced offline by quantize_model.py; loaded instead of the Caffe model
+# when present
+INT8_MODEL_FILE = './MobileNetSSD_deploy.int8.onnx'
+
+
+class OrtNet:
+    # Minimal adapter exposing the cv2.dnn setInput/forward interface on
+    # top of an ONNX Runtime session, so the inference worker doesn't care
+    # which engine it is driving. ORT compiles the graph once up front:
+    # it fuses BatchNorm/Scale/ReLU chains, pre-plans memory and picks its
+    # tuned MLAS convolution kernels, none of which the OpenCV Caffe
+    # importer does per forward
+    def __init__(self, model_file):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = \
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_file, sess_options=options,
+            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.blob = None
+
+    def setInput(self, blob):
+        self.blob = blob
+
+    def forward(self):
+        return self.session.run(None, {self.input_name: self.blob})[0]
+
+
+def load_net():
+    # Engine preference: ONNX Runtime when it is installed and an ONNX
+    # export of the model is on disk (quantized first), then the OpenCV
+    # dnn engine. --dnn-target only applies to the OpenCV engine; ORT
+    # runs on its CPU provider
+    if ort is not None:
+        for model_file in (INT8_MODEL_FILE, ONNX_MODEL_FILE):
+            if os.path.isfile(model_file):
+                print("[INFO] loading {} with ONNX Runtime...".format(
+                    model_file))
+                return OrtNet(model_file)
+
+    # the OpenCV 4.0 ONNX importer has no QuantizeLinear/DequantizeLinear
+    # support, so the quantized model is only usable through onnxruntime;
+    # without it the Caffe model is the only option left
+    if os.path.isfile(INT8_MODEL_FILE):
+        print("[WARN] {} found but onnxruntime is not installed; "
+              "falling back to the Caffe model".format(INT8_MODEL_FILE))
+
+    print("[INFO] loading model...")
+    net = cv2.dnn.readNetFromCaffe(PROTOTXT_FILE, CAFFEMODEL_FILE)
+    configure_backend(net)
+    return net
+
+
+def configure_backend(net):
+    # With --dnn-target opencl, forward() runs on the integrated GPU in
+    # FP16 through OpenCV's OpenCL path, which both speeds up the network
+    # and frees the CPU for capture, tracking and drawing. Falls through
+    # to the CPU setup when no OpenCL device is available
+    if ARGUMENTS["dnn_target"] == "opencl" and cv2.ocl.haveOpenCL():
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_OPENCL_FP16)
+        print("[INFO] running inference on the OpenCL device (FP16)")
+        return
+
+    # Prefer the OpenVINO Inference Engine backend when this OpenCV build
+    # ships with it: its CPU primitives for the depthwise-separable convs of
+    # MobileNet-SSD are much faster than the generic Caffe importer kernels.
+    # If the build doesn't have the IE plugin, stay on the default backend.
+    try:
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # setPreferableBackend only records a preference; builds without
+        # the IE plugin don't fail until the first forward, so force the
+        # backend to initialize here with a dummy input instead of letting
+        # it blow up later in the inference worker
+        net.setInput(np.zeros((1, 3, BLOB_SIZE[1], BLOB_SIZE[0]),
+                              dtype=np.float32))
+        net.forward()
+        print("[INFO] using OpenVINO inference engine backend")
+    except cv2.error:
+        print("[INFO] OpenVINO backend not available, using default backend")
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
+
+
+def _parse_detections_loop(dets, confidence, box_scale, target_mask):
+    # Scalar version of the detection filter, written loop-style so numba
+    # can compile it to machine code. Takes the raw (N, 7) output rows and
+    # returns an (n, 6) float32 array of [x1, y1, x2, y2, class id,
+    # confidence] for the detections that pass the confidence and target
+    # filters
+    out = np.empty((dets.shape[0], 6), dtype=np.float32)
+    n = 0
+    for i in range(dets.shape[0]):
+        conf = dets[i, 2]
+        if conf <= confidence:
+            continue
+        idx = int(dets[i, 1])
+        if not target_mask[idx]:
+            continue
+        out[n, 0] = dets[i, 3] * box_scale[0]
+        out[n, 1] = dets[i, 4] * box_scale[1]
+        out[n, 2] = dets[i, 5] * box_scale[2]
+        out[n, 3] = dets[i, 6] * box_scale[3]
+        out[n, 4] = idx
+        out[n, 5] = conf
+        n += 1
+    return out[:n]
+
+
+def _parse_detections_numpy(dets, confidence, box_scale, target_mask):
+    # vectorized fallback with the same contract, used when numba is not
+    # installed
+    dets = dets[dets[:, 2] > confidence]
+    indexes = dets[:, 1].astype(np.int64)
+    keep = target_mask[indexes]
+    dets = dets[keep]
+    indexes = indexes[keep]
+    boxes = dets[:, 3:7] * box_scale
+    return np.column_stack(
+        (boxes, indexes, dets[:, 2])).astype(np.float32)
+
+
+# numba is optional: when it is available the scalar loop is JIT-compiled
+# (cached on disk, so the compile cost is paid once), otherwise we keep the
+# NumPy implementation
+try:
+    from numba import njit
+    parse_detections = njit(cache=True)(_parse_detections_loop)
+except ImportError:
+    parse_detections = _parse_detections_numpy
+
+
+def draw_date(frame, date_overlay, rendered_date):
+    # The timestamp only changes once per second, but putText rasterizes
+    # its glyphs on every call. Render the text into a small overlay when
+    # it changes and paste just that region onto the frame otherwise.
+    # Returns the text currently in the overlay so the caller can pass it
+    # back on the next frame
+    current_date = datetime.datetime.now().strftime(CURRENT_DATE_FORMAT_STRING)
+    if current_date != rendered_date:
+        date_overlay[:] = 0
+        cv2.putText(date_overlay, current_date, (0, 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 255, 0), 2)
+        rendered_date = current_date
+
+    # paste only the lit pixels so the frame shows through around the
+    # text. The mask is reduced across channels so glyph pixels are copied
+    # whole; a per-element mask would only overwrite the green channel and
+    # leave the frame's blue/red shining through the text
+    roi = frame[-date_overlay.shape[0]:, -date_overlay.shape[1]:]
+    mask = (date_overlay > 0).any(axis=2)
+    np.copyto(roi, date_overlay, where=mask[:, :, None])
+    return rendered_date
+
+
+def put_result(output_queue, frame, det_rows):
+    # replace a result the main thread hasn't consumed yet instead of
+    # blocking on it
+    if output_queue.full():
+        try:
+            output_queue.get_nowait()
+        except queue.Empty:
+            pass
+    output_queue.put((frame, det_rows))
+
+
+def publish_frame(display_cond, display_slot, frame):
+    # hand a drawn frame to the display thread, replacing one it hasn't
+    # shown yet, and wake it up
+    with display_cond:
+        display_slot[0] = frame
+        display_cond.notify()
+
+
+def display_worker(display_cond, display_slot, stop_event):
+    # Dedicated UI thread. Instead of every loop iteration paying the
+    # ~1 ms floor of cv2.waitKey(1), the display sleeps on a condition and
+    # only wakes when a newly drawn frame is published, so the processing
+    # loop is never capped by the UI. Pressing `q` here sets the shared
+    # stop event, which the main loop polls
+    cv2.namedWindow("Frame")
+    cv2.moveWindow("Frame", 380, 150)
+
+    while not stop_event.is_set():
+        with display_cond:
+            display_cond.wait(timeout=0.1)
+            frame = display_slot[0]
+            display_slot[0] = None
+
+        if frame is not None:
+            cv2.imshow("Frame", frame)
+
+        # pump the HighGUI event loop even when no new frame arrived, so
+        # the window keeps repainting and `q` keeps working while the
+        # pipeline is stalled
+        if (cv2.waitKey(1) & 0xFF) == ord("q"):
+            stop_event.set()
+
+
+def inference_worker(net, input_queue, output_queue, stop_event):
+    # Runs preprocessing and net.forward() off the main thread. The heavy
+    # lifting happens inside OpenCV's C++ code, which releases the GIL, so
+    # capture and drawing/display genuinely overlap with inference and the
+    # loop throughput becomes the slowest stage instead of the sum of all
+    # three. Both queues hold a single item and stale entries are dropped,
+    # keeping latency bounded. Results are emitted as a (frame, rows)
+    # pair, where rows are the raw (N, 7) detection rows for that frame
+    skip_frames = ARGUMENTS["skip_frames"]
+    batch_size = ARGUMENTS["batch_size"]
+    frame_number = 0
+    last_rows = None
+
+    # preallocated preprocess buffers. blobFromImage allocates a fresh
+    # ~1 MB float32 blob on every call; building the blob manually into
+    # these resident buffers does the same resize + mean subtraction +
+    # scaling without any per-frame malloc/free
+    resized = np.empty((BLOB_SIZE[1], BLOB_SIZE[0], 3), dtype=np.uint8)
+    scratch = np.empty((BLOB_SIZE[1], BLOB_SIZE[0], 3), dtype=np.float32)
+    blob = np.empty((batch_size, 3, BLOB_SIZE[1], BLOB_SIZE[0]),
+                    dtype=np.float32)
+
+    # frames waiting in the current batch; batching several frames into
+    # one forward amortizes the fixed per-layer setup cost, at the price
+    # of batch-1 frames of latency
+    batch = []
+
+    # a crash in this thread must not leave the app running headless with
+    # no way to quit: flag shutdown so the main loop and the display
+    # thread exit cleanly instead of hanging on an empty queue
+    try:
+        while not stop_event.is_set():
+            try:
+                frame = input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # webcam feeds rarely need fresh detections at full frame
+            # rate, so only run the network every skip_frames-th frame and
+            # pair the frames in between with the previous output right
+            # away; the centroid tracker downstream still updates against
+            # every frame, so object IDs keep flowing
+            if last_rows is not None and frame_number % skip_frames != 0:
+                frame_number += 1
+                put_result(output_queue, frame, last_rows)
+                continue
+            frame_number += 1
+
+            # preprocess into this frame's slot of the batched blob:
+            # HWC -> CHW, keeping channel order (BGR), same arithmetic as
+            # blobFromImage with swapRB=False
+            cv2.resize(frame, BLOB_SIZE, dst=resized,
+                       interpolation=cv2.INTER_LINEAR)
+            np.subtract(resized, BLOB_MEAN, out=scratch)
+            np.multiply(scratch, BLOB_SCALE, out=scratch)
+            blob[len(batch)] = scratch.transpose(2, 0, 1)
+            batch.append(frame)
+            if len(batch) < batch_size:
+                continue
+
+            net.setInput(blob)
+            detections = net.forward()
+
+            # rows carry the batch image id in column 0; hand each frame
+            # its own rows, in capture order
+            rows = detections[0, 0]
+            for (image_id, batched_frame) in enumerate(batch):
+                last_rows = rows[rows[:, 0] == image_id]
+                put_result(output_queue, batched_frame, last_rows)
+            batch = []
+    except Exception:
+        traceback.print_exc()
+        print("[ERROR] inference worker crashed, shutting down")
+    finally:
+        stop_event.set()
+
 
 def main():
     program_data = config_file_loader.load(ARGUMENTS['file'])
@@ -69,6 +396,31 @@ def main():
     if targets is not None:
         targets = targets.keys()
 
+    # boolean table indexed by class id, so filtering detections down to
+    # the target classes is an array gather instead of a string membership
+    # probe per detection
+    target_mask = np.zeros(len(CLASSES), dtype=bool)
+    if targets is not None:
+        for target in targets:
+            if target in CLASSES:
+                target_mask[CLASSES.index(target)] = True
+
+    # pre-extract each target's config fields once, so the per-object loop
+    # does a single dict lookup per target instead of re-probing
+    # program_data four times per object per frame. min/max are folded
+    # into a closed [minimum, maximum] range, with missing bounds mapped
+    # to +/- infinity, so the per-object check is a single comparison
+    target_configs = {}
+    if targets is not None:
+        target_configs = {
+            name: [(t.get('min') if t.get('min') is not None
+                    else float('-inf'),
+                    t.get('max') if t.get('max') is not None
+                    else float('inf'),
+                    t.get('properties'), t.get('counter'))
+                   for t in target_list]
+            for (name, target_list) in program_data['targets'].items()}
+
     # Dictionary of counter names specified by the user in the DSL program.
     # Each key is the name of the counter, and the value is a set, whose elements
     # are the IDs of the objects detected
@@ -83,34 +435,92 @@ def main():
     activities_conditions = program_data.get('activities_conditions')
 
     # load our serialized model from disk
-    print("[INFO] loading model...")
-    net = cv2.dnn.readNetFromCaffe(
-        './MobileNetSSD_deploy.prototxt.txt', './MobileNetSSD_deploy.caffemodel')
+    net = load_net()
 
     # initialize the video stream, allow the cammera sensor to warmup,
     # and initialize the FPS counter
     print("[INFO] starting video stream...")
-    video_source = VideoStream(src=0).start()
+    video_source = VideoStream(src=0)
+    # the V4L2 driver queues ~4 frames by default, so each read would hand
+    # us a frame that is already several intervals old. A single-slot
+    # buffer keeps the background reader thread on the freshest frame
+    video_source.stream.stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    video_source.start()
     time.sleep(2.0)
     fps = FPS().start()
 
     centroid_tracker = CentroidTracker()
 
-    frame1 = video_source.read()
-    frame1 = imutils.resize(frame1, width=600)
-
-    frame2 = video_source.read()
-    frame2 = imutils.resize(frame2, width=600)
+    # the camera resolution is fixed, so compute the resize target once
+    # instead of letting imutils redo the aspect-ratio math on every frame
+    first_frame = video_source.read()
+    (src_h, src_w) = first_frame.shape[:2]
+    frame_size = (FRAME_WIDTH, int(src_h * FRAME_WIDTH / src_w))
 
-    cv2.namedWindow("Frame")
-    cv2.moveWindow("Frame", 380, 150)
+    # the frame1/frame2 history is only consumed by activity detection, so
+    # don't pay the extra reads and resizes when no activities are
+    # configured
+    if activities is not None:
+        frame1 = cv2.resize(first_frame, frame_size,
+                            interpolation=cv2.INTER_LINEAR)
+        frame2 = cv2.resize(video_source.read(), frame_size,
+                            interpolation=cv2.INTER_LINEAR)
+
+    # rotating resize output buffers to avoid a fresh allocation per frame.
+    # A frame stays alive while it sits in the input queue, in the
+    # worker's batch, in the result queue, on screen and in the display
+    # slot, so the pool has to be at least that deep or the capture resize
+    # overwrites frames still in flight. The batch fills the slowest when
+    # it composes with --skip-frames: only every Nth frame joins it while
+    # the skipped ones keep cycling buffers, so the oldest batch member
+    # can be skip_frames * batch_size captures old before its forward runs
+    frame_buffers = itertools.cycle(
+        [np.empty((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+         for _ in range(
+             ARGUMENTS["skip_frames"] * ARGUMENTS["batch_size"] + 4)])
+
+    # factor to scale the network's relative box coordinates back up to
+    # pixels; constant now that the frame size is fixed
+    box_scale = np.array(
+        [frame_size[0], frame_size[1], frame_size[0], frame_size[1]],
+        dtype=np.float32)
+
+    # overlay holding the pre-rendered timestamp for the bottom right
+    # corner; sized to match the old putText placement
+    date_overlay = np.zeros((30, 345, 3), dtype=np.uint8)
+    rendered_date = None
+
+    # pipeline capture -> inference -> draw -> display: the inference
+    # worker owns the network, the display thread owns the window, and the
+    # main thread keeps capture, tracking and drawing
+    input_queue = queue.Queue(maxsize=1)
+    # deep enough to hold a whole batch of results: after a batched
+    # forward the worker emits all of its frames back-to-back, and a
+    # single-slot queue would drop every one of them but the last
+    output_queue = queue.Queue(maxsize=ARGUMENTS["batch_size"])
+    stop_event = threading.Event()
+    worker = threading.Thread(
+        target=inference_worker,
+        args=(net, input_queue, output_queue, stop_event), daemon=True)
+    worker.start()
+
+    display_cond = threading.Condition()
+    display_slot = [None]
+    display = threading.Thread(
+        target=display_worker,
+        args=(display_cond, display_slot, stop_event), daemon=True)
+    display.start()
 
     # loop over the frames from the video stream
     while True:
-        # grab the frame from the threaded video stream and resize it
-        # to have a maximum width of 400 pixels
-        frame = video_source.read()
-        frame = imutils.resize(frame, width=600)
+        # grab the frame from the threaded video stream and resize it into
+        # the next rotating buffer. The resize stays on the CPU even under
+        # --dnn-target opencl: tracking, drawing and the blob build all
+        # need the ndarray immediately, so a UMat round trip would spend
+        # more on the host<->device copies than the one resize it offloads
+        frame = cv2.resize(video_source.read(), frame_size,
+                           dst=next(frame_buffers),
+                           interpolation=cv2.INTER_LINEAR)
 
         # Check if there are activities to look for
         if activities is not None:
@@ -120,65 +530,66 @@ def main():
                     activity, activities_conditions, frame)
 
         if targets is None:
-            current_date = datetime.datetime.now().strftime(CURRENT_DATE_FORMAT_STRING)
-            cv2.putText(frame, current_date,
-                        (frame.shape[1]-345, frame.shape[0]-10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 255, 0), 2)
-            cv2.imshow("Frame", frame)
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord("q"):
+            rendered_date = draw_date(frame, date_overlay, rendered_date)
+            publish_frame(display_cond, display_slot, frame)
+            if stop_event.is_set():
                 break
             continue
 
-        # grab the frame dimensions and convert it to a blob
-        (h, w) = frame.shape[:2]
-        blob = cv2.dnn.blobFromImage(cv2.resize(
-            frame, (300, 300)), 0.007843, (300, 300), 127.5)
+        # hand the frame to the inference thread; the blocking put paces
+        # capture to the rate the worker actually consumes frames. If the
+        # worker died nobody will drain the queue, so watch the stop
+        # event instead of blocking forever
+        submitted = False
+        while not submitted and not stop_event.is_set():
+            try:
+                input_queue.put(frame, timeout=0.1)
+                submitted = True
+            except queue.Full:
+                pass
+        if stop_event.is_set():
+            break
+
+        # take the next finished result if one is ready, without blocking
+        # capture: while the worker is accumulating a batch there is
+        # nothing to consume yet, and after a batched forward its frames
+        # arrive in a burst that the batch-deep queue holds until we
+        # drain it, one per iteration
+        try:
+            (frame, det_rows) = output_queue.get_nowait()
+        except queue.Empty:
+            continue
 
-        # pass the blob through the network and obtain the detections and
-        # predictions
-        net.setInput(blob)
-        detections = net.forward()
         rects = []
 
         # To keep the count of objects detected for a target class
         class_counter = {}
 
-        # loop over the amount of detected objects
-        for i in np.arange(0, detections.shape[2]):
-            # extract the confidence (i.e., probability) associated with
-            # the prediction
-            confidence = detections[0, 0, i, 2]
-
-            # filter out weak detections by ensuring the `confidence` is
-            # greater than the minimum confidence
-            if confidence > ARGUMENTS["confidence"]:
-                # extract the index of the class label from the
-                # `detections`, then compute the (x, y)-coordinates of
-                # the bounding box for the object
-                idx = int(detections[0, 0, i, 1])
-
-                class_name = CLASSES[idx]
-                if class_name not in targets:
-                    continue
+        # filter the raw (N, 7) output down to the confident, targeted
+        # detections and scale their boxes to pixels in one compiled (or
+        # vectorized) pass; Python only touches the few surviving rows
+        parsed = parse_detections(
+            det_rows, ARGUMENTS["confidence"], box_scale, target_mask)
+        boxes = parsed[:, :4].astype(int)
+        indexes = parsed[:, 4].astype(int)
 
-                # Increment the amount of objects seen for this class
-                class_counter[class_name] = class_counter.get(
-                    class_name, 0) + 1
+        # loop over the surviving detections
+        for (idx, confidence, (x1, y1, x2, y2)) in zip(
+                indexes, parsed[:, 5], boxes):
+            class_name = CLASSES[idx]
 
-                # Get the bounding box coordinates
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                (x1, y1, x2, y2) = box.astype("int")
+            # Increment the amount of objects seen for this class
+            class_counter[class_name] = class_counter.get(class_name, 0) + 1
 
-                bbox_height = y2 - y1
+            bbox_height = y2 - y1
 
-                p1 = (x1, int(y1+bbox_height/2) + 40)
-                p2 = (x2, int(y2-bbox_height/2) + 40)
+            p1 = (x1, int(y1+bbox_height/2) + 40)
+            p2 = (x2, int(y2-bbox_height/2) + 40)
 
-                label = "{}: {:.2f}%".format(class_name, confidence * 100)
-                labely = y1 - 15 if y1 - 15 > 15 else y1 + 15
-                rects.append(
-                    [x1, y1, x2, y2, (p1, p2, label, labely, COLORS[idx], class_name)])
+            label = "{}: {:.2f}%".format(class_name, confidence * 100)
+            labely = y1 - 15 if y1 - 15 > 15 else y1 + 15
+            rects.append(
+                [x1, y1, x2, y2, (p1, p2, label, labely, COLORS[idx], class_name)])
 
         objects = centroid_tracker.update(rects)
 
@@ -187,14 +598,11 @@ def main():
         for (object_id, (centroid, rect)) in objects.items():
             (x1, y1, x2, y2, (p1, p2, label, labely, color, target_name)) = rect
 
-            for target in program_data['targets'][target_name]:
-                minimum = target.get('min')
-                maximum = target.get('max')
+            # counter_name is the name of the counter specified by the user
+            # in the DSL program
+            for (minimum, maximum, properties,
+                 counter_name) in target_configs[target_name]:
                 detected_objects = class_counter.get(target_name)
-                properties = target.get('properties')
-
-                # Name of the counter specified by the user in the DSL program
-                counter_name = target.get('counter')
 
                 if detected_objects is None:
                     continue
@@ -217,51 +625,33 @@ def main():
                     'counter_name': counter_name,
                 }
 
-                # Specified both minimum and maximum amount of objects
-                if minimum is not None and maximum is not None:
-                    if minimum <= detected_objects <= maximum:
-                        check_target_properties(
-                            frame, properties, counters, object_data)
-
-                # Just minimum
-                elif minimum is not None and maximum is None:
-                    if detected_objects >= minimum:
-                        check_target_properties(
-                            frame, properties, counters, object_data)
-
-                # Just maximum
-                elif minimum is None and maximum is not None:
-                    if detected_objects <= maximum:
-                        check_target_properties(
-                            frame, properties, counters, object_data)
-
-                # Neither minimum nor maximum
-                else:
-                    # So just check properties onwards
+                # the bounds were normalized at startup, so one range
+                # check covers the min/max/both/neither cases
+                if minimum <= detected_objects <= maximum:
                     check_target_properties(
                         frame, properties, counters, object_data)
 
-        # show the current date on the bottom right corner
-        current_date = datetime.datetime.now().strftime(CURRENT_DATE_FORMAT_STRING)
-        cv2.putText(frame, current_date,
-                    (frame.shape[1]-345, frame.shape[0]-10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 255, 0), 2)
-        cv2.imshow("Frame", frame)
-        key = cv2.waitKey(1) & 0xFF
+        # show the current date on the bottom right corner and publish the
+        # finished frame to the display thread
+        rendered_date = draw_date(frame, date_overlay, rendered_date)
+        publish_frame(display_cond, display_slot, frame)
 
-        # if the `q` key was pressed, break from the loop
-        if key == ord("q"):
+        # the display thread flips the stop event when `q` is pressed
+        if stop_event.is_set():
             break
 
         # update the FPS counter
         fps.update()
 
     # stop the timer and display FPS information
+    stop_event.set()
     fps.stop()
     print("[INFO] elapsed time: {:.2f}".format(fps.elapsed()))
     print("[INFO] approx. FPS: {:.2f}".format(fps.fps()))
 
-    # do a bit of cleanup
+    # do a bit of cleanup; let the display thread leave imshow before
+    # tearing the window down
+    display.join(timeout=1.0)
     cv2.destroyAllWindows()
     video_source.stop()
 
@@ -0,0 +1,65 @@
+# Offline helper to quantize the MobileNet-SSD detector to INT8.
+#
+# FP32 convolutions dominate the per-frame cost of the detector. With int8
+# weights and activations the CPU moves half the bytes and, on chips with
+# VNNI, processes 4x the elements per instruction. The accuracy cost is
+# negligible for this network when the quantization scales are calibrated
+# on representative input frames.
+#
+# Usage:
+#   1. pip install onnxruntime (>=1.5 for the static quantization API).
+#      onnxruntime is deliberately not in requirements.txt: it is only
+#      needed when quantizing or running the ONNX export, and recent
+#      releases need a newer numpy than the one pinned there, so install
+#      it in a separate environment for this offline step
+#   2. Export the Caffe model to ONNX (e.g. with caffe2onnx):
+#        python -m caffe2onnx.convert \
+#            --prototxt MobileNetSSD_deploy.prototxt.txt \
+#            --caffemodel MobileNetSSD_deploy.caffemodel \
+#            --onnx MobileNetSSD_deploy.onnx
+#   3. Drop ~200 representative frames (jpg/png) into ./calibration_frames
+#   4. python quantize_model.py
+#
+# main.py picks up the quantized model automatically when the output file
+# is present next to the Caffe one.
+
+import glob
+
+import cv2
+from onnxruntime.quantization import CalibrationDataReader, quantize_static
+
+FLOAT_MODEL = './MobileNetSSD_deploy.onnx'
+INT8_MODEL = './MobileNetSSD_deploy.int8.onnx'
+CALIBRATION_GLOB = './calibration_frames/*'
+CALIBRATION_FRAMES = 200
+
+
+class FrameReader(CalibrationDataReader):
+    # Feeds calibration frames to the quantizer preprocessed exactly like
+    # the main loop does, so the computed int8 scales match live input
+    def __init__(self, paths):
+        self.paths = iter(paths)
+
+    def get_next(self):
+        path = next(self.paths, None)
+        if path is None:
+            return None
+        frame = cv2.imread(path)
+        blob = cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5)
+        return {'data': blob}
+
+
+def main():
+    paths = sorted(glob.glob(CALIBRATION_GLOB))[:CALIBRATION_FRAMES]
+    if not paths:
+        print("[ERROR] no calibration frames found in ./calibration_frames")
+        return
+
+    print("[INFO] quantizing {} with {} calibration frames...".format(
+        FLOAT_MODEL, len(paths)))
+    quantize_static(FLOAT_MODEL, INT8_MODEL, FrameReader(paths))
+    print("[INFO] wrote {}".format(INT8_MODEL))
+
+
+if __name__ == '__main__':
+    main()